@@ -0,0 +1,39 @@
+# Importing Neccessary libraries
+import os
+import sys
+import argparse
+path_ = os.path.dirname(__file__)
+sys.path.append(path_)
+from libraries import benchmark_utils as bench
+os.chdir(path_)
+
+# Benchmark parameters
+# Row counts go from 10^4 up to 10^8, the defaults keep a run under a few minutes
+parser = argparse.ArgumentParser(description="Benchmark the data pipeline on synthetic renewable energy data")
+parser.add_argument("--rows", type=int, nargs='+', default=[10**4, 10**5, 10**6], help="Row counts to benchmark")
+parser.add_argument("--extra-columns", type=int, default=0, help="Extra numeric columns added to the generated data")
+parser.add_argument("--null-rate", type=float, default=0.0, help="Share of measure cells left empty")
+parser.add_argument("--repeat", type=int, default=5, help="Timed runs per function, the median is reported")
+parser.add_argument("--warmup", type=int, default=1, help="Untimed runs per function before the timed runs")
+parser.add_argument("--seed", type=int, default=42, help="Seed of the data generator")
+parser.add_argument("--output", default="benchmark_results.json", help="JSON file the results are written to")
+parser.add_argument("--baseline", default=None, help="Earlier results file to compare against")
+args = parser.parse_args()
+
+################ RUN THE BENCHMARKS ####################
+results = bench.run_benchmarks(args.rows, n_extra_columns=args.extra_columns, null_rate=args.null_rate, seed=args.seed, repeat=args.repeat, warmup=args.warmup)
+bench.save_benchmark_results(results, args.output, vars(args))
+########################################################
+
+################ COMPARE WITH THE BASELINE ####################
+if args.baseline is not None:
+    regressions = bench.compare_benchmark_results(args.baseline, args.output)
+    for regression in regressions:
+        if regression.get("status") == "failed":
+            print(f"Failed: {regression['function']} on {regression['rows']} rows")
+            continue
+        print(f"Regression: {regression['function']} on {regression['rows']} rows is {regression['change']:.0%} slower "
+              f"({regression['baseline_seconds']}s -> {regression['current_seconds']}s)")
+    if not regressions:
+        print(f"\nNo regressions compared to {args.baseline}")
+########################################################
@@ -0,0 +1,79 @@
+# Importing Neccessary libraries
+import os
+import sys
+import argparse
+import logging
+path_ = os.path.dirname(__file__)
+sys.path.append(path_)
+from libraries import forecast_utils as fc
+from libraries import metrics_utils as metrics
+os.chdir(path_)
+
+# The process pool spawns new interpreters that import this file again,
+# so the run and the Spark and AWS libraries stay inside the guard
+if __name__ == "__main__":
+    from libraries import aws_utils as aws
+    from libraries import sql_utils as sql
+    from libraries import helper_utils as helper
+    from libraries import local_utils as local
+
+    metrics.export_metrics_at_exit("forecast_metrics.jsonl", "forecast_metrics.prom")
+
+    # Forecast parameters
+    parser = argparse.ArgumentParser(description="Forecast every series of a Hive table with Prophet")
+    parser.add_argument("--table", required=True, help="Hive table holding the series")
+    parser.add_argument("--value-column", required=True, help="Column to forecast")
+    parser.add_argument("--series-columns", nargs='+', default=['country', 'technology'], help="Columns identifying a series")
+    parser.add_argument("--date-column", default='year', help="Year or date column of the series")
+    parser.add_argument("--schema", default="project_schema_001", help="Hive schema of the table")
+    parser.add_argument("--periods", type=int, default=5, help="Number of periods to forecast")
+    parser.add_argument("--freq", default='YS', help="Pandas frequency of the series")
+    parser.add_argument("--workers", type=int, default=None, help="Number of worker processes")
+    args = parser.parse_args()
+
+    ################ LOAD THE SERIES ####################
+    # All the series are pulled in one query and split locally
+    query = fc.build_series_query(args.schema, args.table, args.series_columns, args.date_column, args.value_column)
+    if helper.EXECUTION_BACKEND == 'local':
+        helper.enable_hive_support()
+        df = helper.get_spark_session().sql(query).toPandas()
+    else:
+        # Uses the Presto connection written by Main_File.py
+        engine = sql.create_presto_engine()
+        df = sql.sql_to_df(query, engine)
+    series = fc.split_series(df, args.series_columns, args.date_column, args.value_column)
+    print(f"Loaded {len(series)} series from {args.schema}.{args.table}")
+    ########################################################
+
+    ################ FIT AND FORECAST ####################
+    # Unchanged series load their cached model instead of fitting again
+    forecasts = fc.forecast_series(series, args.periods, args.freq, max_workers=args.workers)
+    table_name = f"{args.table}_forecast"
+    file_columns = fc.write_forecasts_to_parquet(forecasts, args.series_columns, table_name)
+    ########################################################
+
+    ################ REGISTER IN HIVE ####################
+    # The forecasts take the same way into Hive as the pipeline tables:
+    # bucket -> HDFS of the cluster saved by Main_File.py -> table create statement
+    if helper.EXECUTION_BACKEND == 'local':
+        backend = local
+        aws_connection, cluster_id = None, local.LOCAL_CLUSTER_ID
+    else:
+        backend = aws
+        aws_connection = helper.read_jsons()['aws_connection']
+        cluster_id = helper.read_emr_cluster()['cluster_id']
+    bucket_name = "isom-671-23-team15-bigdata-project-forecasts"
+    s3_bucket_path = "project_data/forecasts/"
+    backend.create_s3_bucket(bucket_name, aws_connection)
+    backend.upload_multiple_files_to_s3_bucket(f"parquets/{table_name}", bucket_name, f"{s3_bucket_path}{table_name}/", aws_connection, 'parquet')
+    if not backend.list_s3_bucket_keys(bucket_name, f"{s3_bucket_path}{table_name}/", aws_connection):
+        logging.error(f"No forecast files were uploaded to {bucket_name}.")
+        sys.exit(1)
+    # Hive creates the table as managed, dropping it deletes its folder,
+    # so the old table is dropped before the new files are copied there
+    backend.execute_hive_query(cluster_id, aws_connection, f"DROP TABLE IF EXISTS {args.schema}.{table_name};")
+    hdfs_folder = backend.copy_parquets_to_hdfs(cluster_id, bucket_name, s3_bucket_path, aws_connection)
+    backend.delete_s3_bucket(bucket_name, aws_connection)
+    backend.execute_table_create_statements(cluster_id, aws_connection, [file_columns], args.schema, hdfs_folder)
+    print(f"\nForecasts registered in Hive as {args.schema}.{table_name}")
+    ########################################################
@@ -1,74 +1,144 @@
 # Importing Neccessary libraries
 import os
 import sys
+import logging
 path_ = os.path.dirname(__file__)
 sys.path.append(path_)
 from libraries import aws_utils as aws
 from libraries import sql_utils as sql
 from libraries import helper_utils as helper
+from libraries import local_utils as local
+from libraries import metrics_utils as metrics
 os.chdir(path_)
+# Stage timers and counters are written to metrics.jsonl and metrics.prom when the run ends
+# Set PIPELINE_PROFILE=1 to also write cProfile stats of the hot functions to profiles/
+metrics.export_metrics_at_exit()
 
-# Read the json files
-json_load = helper.read_jsons()
-# Specifying the schema, aws_connection and emr cluster parameters
+# Specifying the schema and the file locations
 schema = "project_schema_001"
-aws_connection = json_load['aws_connection']
-emr_params = json_load['emr_parameters']
+files_folder = "./project_datasets/"
+s3_bucket_path = "project_data/parquets/"
+
+################ EXECUTION BACKEND ####################
+# Set EXECUTION_BACKEND=local to run the same steps on a local Spark session
+# Local folders stand in for S3 and HDFS, so small runs and tests finish in seconds
+if helper.EXECUTION_BACKEND == 'local':
+    backend = local
+    aws_connection, emr_params = None, {}
+    run_state_file = "run_state_local.json"
+else:
+    backend = aws
+    # Read the json files
+    json_load = helper.read_jsons()
+    # Specifying the aws_connection and emr cluster parameters
+    aws_connection = json_load['aws_connection']
+    emr_params = json_load['emr_parameters']
+    run_state_file = "run_state.json"
+########################################################
+
+################ RUN STATE CHECKPOINT ####################
+# Every completed stage and its outputs are saved to run_state.json
+# If a step fails, the next run resumes from the first incomplete stage
+# The checkpoint is discarded when the files in the datasets folder change
+input_fingerprint = helper.get_input_fingerprint(files_folder)
+run_state = helper.load_run_state(run_state_file, input_fingerprint)
+outputs = run_state['outputs']
+# A checkpointed cluster can only be reused while it is still up
+# The checkpoint is only discarded once the cluster is gone, otherwise a second cluster would be started
+if outputs.get('cluster_id'):
+    cluster_state = backend.get_emr_cluster_state(outputs['cluster_id'], aws_connection)
+    if cluster_state is None or cluster_state.startswith('TERMINAT'):
+        print(f"EMR Cluster {outputs['cluster_id']} is no longer available. Starting a new run.")
+        helper.clear_run_state(run_state_file)
+        run_state = helper.load_run_state(run_state_file, input_fingerprint)
+        outputs = run_state['outputs']
+    elif cluster_state not in ['WAITING', 'RUNNING']:
+        logging.error(f"EMR Cluster {outputs['cluster_id']} is {cluster_state}. Try again once it is WAITING.")
+        sys.exit(1)
+########################################################
 
 ################ CREATING S3 BUCKET ####################
-bucket_name = f"isom-671-23-team15-bigdata-project-bucket"
-aws.create_s3_bucket(bucket_name, aws_connection)
+bucket_name = outputs.get('bucket_name', f"isom-671-23-team15-bigdata-project-bucket")
+if not helper.is_stage_complete(run_state, 'create_bucket'):
+    with metrics.timer('pipeline_stage_seconds', stage='create_bucket'):
+        backend.create_s3_bucket(bucket_name, aws_connection)
+    helper.mark_stage_complete(run_state, 'create_bucket', {'bucket_name': bucket_name}, run_state_file)
 ########################################################
 
 ########## Using Spark to load the files ##########
 # Use Spark to load the files
 # Save them to a new folder as parquet files
 # then load the parquet files into s3 bucket
-files_folder = "./project_datasets/"
-s3_bucket_path = "project_data/parquets/"
 # Using Threading to make the process faster
 # Basically running one thread in parallel with another
 # One thread is responsible for changing csv files to parquets and uploading them to s3 bucket
 # The other thread is responsible for creating the emr cluster
 # These two processes can run concurrently
-thread1 = aws.CustomThread(target=aws.upload_multiple_files_to_s3_bucket_as_parquet, args=(files_folder, bucket_name, s3_bucket_path, aws_connection))
-thread1.start()
+# Stages finished in a previous run are not started again
+if not helper.is_stage_complete(run_state, 'upload_parquets'):
+    upload_stage = metrics.timed(backend.upload_multiple_files_to_s3_bucket_as_parquet, 'pipeline_stage_seconds', stage='upload_parquets')
+    thread1 = aws.CustomThread(target=upload_stage, args=(files_folder, bucket_name, s3_bucket_path, aws_connection))
+    thread1.start()
 ########################################################
 
 ################ CREATE EMR INSTANCE ####################
 # Specifying applications
 applications = ['hadoop', 'hive', 'hue', 'presto']
 # This the second thread to create the cluster
-thread2 = aws.CustomThread(target=aws.create_emr_cluster, args=(emr_params, aws_connection, applications))
-thread2.start()
-cluster_id, cluster_url = thread2.join()
-files_column_types = thread1.join()
+if not helper.is_stage_complete(run_state, 'create_cluster'):
+    cluster_stage = metrics.timed(backend.create_emr_cluster, 'pipeline_stage_seconds', stage='create_cluster')
+    thread2 = aws.CustomThread(target=cluster_stage, args=(emr_params, aws_connection, applications))
+    thread2.start()
+    cluster_id, cluster_url = thread2.join()
+    helper.mark_stage_complete(run_state, 'create_cluster', {'cluster_id': cluster_id, 'cluster_url': cluster_url}, run_state_file)
+if not helper.is_stage_complete(run_state, 'upload_parquets'):
+    files_column_types = thread1.join()
+    uploaded_keys = backend.list_s3_bucket_keys(bucket_name, s3_bucket_path, aws_connection)
+    # Failed uploads are only logged, so the stage is checked against the local parquet files
+    missing_keys = set(helper.get_parquet_upload_keys(s3_bucket_path)) - set(uploaded_keys)
+    if missing_keys:
+        logging.error(f"{len(missing_keys)} parquet files were not uploaded: {sorted(missing_keys)}")
+        sys.exit(1)
+    helper.mark_stage_complete(run_state, 'upload_parquets', {'files_column_types': files_column_types, 'uploaded_keys': uploaded_keys}, run_state_file)
+cluster_id, cluster_url = outputs['cluster_id'], outputs['cluster_url']
+files_column_types = outputs['files_column_types']
 # Write the connection URL to the auth credentials file
 # Here the other analysts do not have to edit any parameters
 # To make a connection, the code will load the connection from the json file
-helper.write_presto_connector_to_json_file(cluster_url, schema)
+if backend is aws:
+    helper.write_presto_connector_to_json_file(cluster_url, schema, cluster_id)
 ########################################################
 
-################ copy the files to hdfs ####################
-# default folder is hdfs:///user/hadoop/<parquets path>
-hdfs_folder = aws.copy_parquets_to_hdfs(cluster_id, bucket_name, s3_bucket_path, aws_connection)
-aws.delete_s3_bucket(bucket_name,aws_connection)
-########################################################
 ################## WRITE HIVE QUERY ####################
-## drop schema if exits
-drop_schema_query = f"DROP SCHEMA IF EXISTS  {schema} CASCADE;"
-aws.execute_hive_query(cluster_id, aws_connection, drop_schema_query)
-## create schema
-create_hive_schema_query = f"CREATE schema {schema};"
-aws.execute_hive_query(cluster_id, aws_connection, create_hive_schema_query)
+# The schema, the copy to hdfs and the tables are one stage
+# Hive drops the folders of managed tables with the schema, so a rerun after a failed
+# table create has to drop the schema and copy the files again before creating the tables
+if not helper.is_stage_complete(run_state, 'create_tables'):
+    with metrics.timer('pipeline_stage_seconds', stage='create_tables'):
+        ## drop schema if exits
+        drop_schema_query = f"DROP SCHEMA IF EXISTS  {schema} CASCADE;"
+        backend.execute_hive_query(cluster_id, aws_connection, drop_schema_query)
+        ## create schema
+        create_hive_schema_query = f"CREATE schema {schema};"
+        backend.execute_hive_query(cluster_id, aws_connection, create_hive_schema_query)
+        ## copy the files to hdfs
+        # default folder is hdfs:///user/hadoop/<parquets path>
+        hdfs_folder = backend.copy_parquets_to_hdfs(cluster_id, bucket_name, s3_bucket_path, aws_connection)
+        backend.execute_table_create_statements(cluster_id, aws_connection, files_column_types, schema, hdfs_folder)
+    helper.mark_stage_complete(run_state, 'create_tables', {'hdfs_folder': hdfs_folder}, run_state_file)
 ########################################################
-aws.execute_table_create_statements(cluster_id, aws_connection, files_column_types, schema, hdfs_folder)
-
-print(f"\nData can be accessed at this connection string: \n\tjdbc:presto://{cluster_url}:8889/hive")
-
-
-
-
-
 
+################ DELETE THE S3 BUCKET ####################
+# The bucket is kept until the tables exist, a rerun of the stage above copies from it again
+if not helper.is_stage_complete(run_state, 'delete_bucket'):
+    with metrics.timer('pipeline_stage_seconds', stage='delete_bucket'):
+        backend.delete_s3_bucket(bucket_name,aws_connection)
+    helper.mark_stage_complete(run_state, 'delete_bucket', state_file=run_state_file)
+########################################################
+# Every stage is done, the next run starts from the beginning
+helper.clear_run_state(run_state_file)
 
+if backend is aws:
+    print(f"\nData can be accessed at this connection string: \n\tjdbc:presto://{cluster_url}:8889/hive")
+else:
+    print(f"\nData can be accessed from the local Spark metastore in schema: {schema}")
@@ -3,21 +3,13 @@ import sys
 sys.path.append(os.path.dirname(__file__))
 import boto3
 from libraries import helper_utils as helper
+from libraries import metrics_utils as metrics
 import warnings
 warnings.simplefilter('ignore')
 import logging
 import time
 from threading import Thread
 
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s [%(levelname)s] %(message)s",
-    handlers=[
-        logging.FileHandler("debug.log"),
-        logging.StreamHandler()
-    ]
-)
-
 
 def create_aws_client_connection(client_type,aws_connection):
     """
@@ -79,9 +71,16 @@ def upload_file_to_s3_bucket(local_file_path, bucket_name, s3_file_location, aws
     """
     try:
         s3_client = create_aws_client_connection('s3',aws_connection)
+        file_size = os.path.getsize(local_file_path)
+        start = time.perf_counter()
         s3_client.upload_file(local_file_path, bucket_name, s3_file_location)
+        seconds = time.perf_counter() - start
+        metrics.observe('s3_upload_seconds', seconds, bucket=bucket_name)
+        metrics.increment('s3_uploaded_bytes', file_size, bucket=bucket_name)
+        metrics.record_rate('s3_upload_mb_per_second', file_size / 1024**2, seconds, file=s3_file_location)
         logging.info(f"Upload for: {local_file_path} Completed Successfully.")
     except Exception as ex:
+        metrics.increment('s3_upload_failures', bucket=bucket_name)
         logging.error(f"Error uploading file to S3: {ex}")
 
 def upload_multiple_files_to_s3_bucket(local_folder_path, bucket_name, s3_folder_path, aws_connection, desired_file_type = 'csv'):
@@ -120,12 +119,20 @@ def create_emr_cluster(emr_params, aws_connection, applications):
     emr_params['Applications'] = [{'Name':i.lower().title()} for i in applications]
     aws_emr_client = create_aws_client_connection('emr', aws_connection)
     try:
+        provisioning_start = time.perf_counter()
         response = aws_emr_client.run_job_flow(**emr_params)
+        metrics.increment('aws_retry_attempts', response['ResponseMetadata'].get('RetryAttempts', 0), operation='run_job_flow')
         cluster_id = response['JobFlowId']
         logging.info(f"\n\tEMR Cluster {cluster_id} is being created.\n")
+        # Time spent in every provisioning state, e.g. STARTING and BOOTSTRAPPING
+        phase, phase_start = None, time.perf_counter()
         while True:
             response = aws_emr_client.describe_cluster(ClusterId=cluster_id)
             state = response['Cluster']['Status']['State']
+            if state.upper() != phase:
+                if phase is not None:
+                    metrics.observe('emr_cluster_phase_seconds', time.perf_counter() - phase_start, state=phase)
+                phase, phase_start = state.upper(), time.perf_counter()
             if state.upper() in ['WAITING','RUNNING']:
                 break
             elif state.upper() in ['TERMINATED','TERMINATED_WITH_ERRORS']:
@@ -135,6 +142,7 @@ def create_emr_cluster(emr_params, aws_connection, applications):
             time.sleep(30)  # Wait for 30 seconds before checking again
 
 
+        metrics.observe('emr_cluster_provisioning_seconds', time.perf_counter() - provisioning_start)
         # Get the master node public DNS
         master_node_dns = response['Cluster']['MasterPublicDnsName']
         logging.info(f"EMR cluster {cluster_id} is ready.")
@@ -145,6 +153,25 @@ def create_emr_cluster(emr_params, aws_connection, applications):
     return cluster_id, master_node_dns
 
 
+def get_emr_cluster_state(cluster_id, aws_connection):
+    """
+    Returns the current state of an emr cluster
+    Returns None if the cluster cannot be found
+    Any other error stops the run, the cluster may still be up and must not be replaced
+    """
+    aws_emr_client = create_aws_client_connection('emr', aws_connection)
+    try:
+        response = aws_emr_client.describe_cluster(ClusterId=cluster_id)
+        return response['Cluster']['Status']['State'].upper()
+    except aws_emr_client.exceptions.InvalidRequestException as ex:
+        # EMR answers an unknown cluster id with an invalid request
+        logging.error(f"EMR Cluster {cluster_id} was not found: {ex}")
+        return None
+    except Exception as ex:
+        logging.error(f"Could not get the state of EMR Cluster {cluster_id}, try again later: {ex}")
+        sys.exit(1)
+
+
 def execute_hive_query(cluster_id, aws_connection, query):
     """
     Builds a hive execution statement
@@ -166,10 +193,12 @@ def execute_emr_command(cluster_id, aws_connection, cmd_steps):
     """
     try:
         aws_emr_client = create_aws_client_connection('emr', aws_connection)
-        response = aws_emr_client.add_job_flow_steps(JobFlowId=cluster_id, Steps=[cmd_steps])
-        # Wait for the step to complete
-        step_id = response['StepIds'][0]
-        aws_emr_client.get_waiter('step_complete').wait(ClusterId=cluster_id, StepId=step_id)
+        with metrics.timer('emr_step_seconds', step=cmd_steps['Name']):
+            response = aws_emr_client.add_job_flow_steps(JobFlowId=cluster_id, Steps=[cmd_steps])
+            metrics.increment('aws_retry_attempts', response['ResponseMetadata'].get('RetryAttempts', 0), operation='add_job_flow_steps')
+            # Wait for the step to complete
+            step_id = response['StepIds'][0]
+            aws_emr_client.get_waiter('step_complete').wait(ClusterId=cluster_id, StepId=step_id)
         print(f'Command executed on EMR cluster {cluster_id}')
     except Exception as ex:
         logging.exception(ex)
@@ -204,13 +233,7 @@ def execute_table_create_statements(cluster_id, aws_connection, files_column_typ
     """
     Builds a executes a hive table create statement for various tables in hive
     """
-    create_statements = ""
-    for file_ in files_column_types:
-        create_table_sql = f"create table {schema}.{file_.get('table_name')} ({file_.get('columns')}) " + \
-                           "row format delimited fields terminated by '\\t' " + \
-                           "lines terminated by '\\n' stored as parquet" + \
-                           f" location '{hdfs_files_path}{file_.get('table_name')}'; "
-        create_statements+= create_table_sql
+    create_statements = helper.build_table_create_statements(files_column_types, schema, hdfs_files_path)
     try:
         execute_hive_query(cluster_id, aws_connection, create_statements)
         logging.info(f"Tables Created successfully.\n{[file_.get('table_name') for file_ in files_column_types]}\n")
@@ -220,6 +243,18 @@ def execute_table_create_statements(cluster_id, aws_connection, files_column_typ
         sys.exit(1)
 
 
+def list_s3_bucket_keys(bucket_name, s3_folder_path, aws_connection):
+    """
+    Lists the keys of all the objects under the specified folder of a bucket
+    """
+    aws_s3_client = create_aws_client_connection('s3', aws_connection)
+    paginator = aws_s3_client.get_paginator('list_objects_v2')
+    keys = []
+    for page in paginator.paginate(Bucket=bucket_name, Prefix=s3_folder_path):
+        keys.extend([obj['Key'] for obj in page.get('Contents', [])])
+    return keys
+
+
 def delete_s3_bucket(bucket_name, aws_connection):
     """
     Deletes an S3 bucket
@@ -227,7 +262,12 @@ def delete_s3_bucket(bucket_name, aws_connection):
     # Create a Boto3 S3 client
     aws_s3_client = create_aws_client_connection('s3', aws_connection)
     # Empty the bucket by deleting all objects
-    objects = aws_s3_client.list_objects(Bucket=bucket_name).get('Contents', [])
+    # A bucket that is already gone counts as deleted, so a resumed run can repeat this step
+    try:
+        objects = aws_s3_client.list_objects(Bucket=bucket_name).get('Contents', [])
+    except aws_s3_client.exceptions.NoSuchBucket:
+        logging.info(f"The bucket {bucket_name} does not exist anymore.")
+        return
     for obj in objects:
         aws_s3_client.delete_object(Bucket=bucket_name, Key=obj['Key'])
     # Delete the empty bucket
@@ -0,0 +1,328 @@
+import os
+import sys
+sys.path.append(os.path.dirname(__file__))
+import json
+import warnings
+warnings.simplefilter('ignore')
+import numpy as np
+import pandas as pd
+import logging
+import platform
+import shutil
+import statistics
+import time
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime
+from moto import mock_aws
+from sqlalchemy import create_engine, event
+from libraries import aws_utils as aws
+from libraries import sql_utils as sql
+from libraries import helper_utils as helper
+
+
+COUNTRIES = ['Albania', 'Austria', 'Belgium', 'Bosnia and Herzegovina', 'Bulgaria', 'Croatia', 'Cyprus',
+             'Czechia', 'Denmark', 'Estonia', 'Finland', 'France', 'Germany', 'Greece', 'Hungary', 'Iceland',
+             'Ireland', 'Italy', 'Latvia', 'Lithuania', 'Luxembourg', 'Malta', 'Montenegro', 'Netherlands',
+             'North Macedonia', 'Norway', 'Poland', 'Portugal', 'Romania', 'Serbia', 'Slovakia', 'Slovenia',
+             'Spain', 'Sweden', 'Switzerland', 'United Kingdom']
+TECHNOLOGIES = ['Bioenergy', 'Solar photovoltaic', 'Concentrated solar power', 'Onshore wind energy',
+                'Offshore wind energy', 'Geothermal energy', 'Renewable hydropower', 'Marine energy']
+YEARS = list(range(2000, 2024))
+
+# Fake credentials for the moto backed S3 benchmark
+MOCK_AWS_CONNECTION = {
+    "aws_access_key_id": "testing",
+    "aws_secret_access_key": "testing",
+    "aws_session_token": "testing"
+}
+BENCHMARK_BUCKET = "benchmark-bucket"
+# pandas and the SQLite insert hold the whole table in memory, so above this row count
+# they are benchmarked on the first rows of the dataset. Spark and the S3 upload always get all the rows
+IN_MEMORY_MAX_ROWS = 10**6
+
+
+def generate_capacity_chunk(start_row, n_rows, n_extra_columns=0, null_rate=0.0, seed=42):
+    """
+    :param start_row:
+    :param n_rows:
+    :return df:
+    Generates rows start_row to start_row + n_rows of a synthetic renewable energy capacity table
+    Rows cycle through countries x technologies x years, so the keys only depend on the row number
+    Every full cycle gets a new Producer Id, which keeps the keys unique for large row counts
+    The random values are seeded with the chunk start, so the data is the same on every run
+    """
+    rng = np.random.default_rng([seed, start_row])
+    row_ids = np.arange(start_row, start_row + n_rows)
+    n_countries, n_technologies, n_years = len(COUNTRIES), len(TECHNOLOGIES), len(YEARS)
+    df = pd.DataFrame({
+        "Producer Id": row_ids // (n_countries * n_technologies * n_years),
+        "Country": np.array(COUNTRIES)[row_ids % n_countries],
+        "Technology": np.array(TECHNOLOGIES)[(row_ids // n_countries) % n_technologies],
+        "Year": np.array(YEARS)[(row_ids // (n_countries * n_technologies)) % n_years],
+        "Electricity Installed Capacity MW": rng.gamma(2.0, 500.0, n_rows).round(3),
+        "Electricity Generation GWh": rng.gamma(2.0, 1500.0, n_rows).round(3),
+        "Number of Sites": rng.integers(1, 5000, n_rows)
+    })
+    for i in range(n_extra_columns):
+        df[f"Extra Metric {i+1}"] = rng.normal(100.0, 25.0, n_rows).round(3)
+    if null_rate > 0:
+        # Keys are never null, only the measures
+        for col in df.columns[4:]:
+            df[col] = df[col].mask(rng.random(n_rows) < null_rate)
+    return df
+
+def generate_capacity_csv(file_path, n_rows, n_extra_columns=0, null_rate=0.0, seed=42, chunk_size=10**6):
+    """
+    Writes a synthetic renewable energy capacity CSV with n_rows rows
+    The file is written in chunks, so 10^8 rows do not have to fit in memory
+    """
+    logging.info(f"Generating {n_rows} rows of synthetic data at {file_path}")
+    os.makedirs(os.path.dirname(file_path) or '.', exist_ok=True)
+    for start_row in range(0, n_rows, chunk_size):
+        df = generate_capacity_chunk(start_row, min(chunk_size, n_rows - start_row), n_extra_columns, null_rate, seed)
+        df.to_csv(file_path, mode='w' if start_row == 0 else 'a', header=start_row == 0, index=False)
+    return file_path
+
+def _run_once(func, args, run_name):
+    """
+    Runs func once and returns (result, succeeded)
+    create_table_and_insert_data calls sys.exit on a failed insert, so SystemExit is caught as well
+    """
+    try:
+        return func(*args), True
+    except (Exception, SystemExit) as ex:
+        logging.error(f"{run_name} run of {func.__name__} failed: {ex}")
+        return None, False
+
+def measure(func, make_args=tuple, repeat=5, warmup=1, check=None):
+    """
+    :param func:
+    :param make_args:
+    :return (result, seconds, min_seconds, peak_memory_mb, succeeded):
+    Runs func warmup times without timing it, so start-up costs like the Spark JVM are left out
+    then runs it repeat times and returns the median and minimum wall time
+    make_args builds the arguments of every run outside the timed block, e.g. a fresh copy of a frame func changes
+    tracemalloc slows down allocations, so the peak python memory is taken from one more untimed run
+    Memory allocated inside the Spark JVM is not tracked by tracemalloc
+    check(result, args) is called after every timed run, a run that returns False or raises is marked as failed
+    A failure in any run marks the benchmark as failed instead of stopping the whole suite
+    """
+    succeeded = True
+    for _ in range(warmup):
+        _, ok = _run_once(func, make_args(), "Warmup")
+        succeeded = succeeded and ok
+    durations = []
+    result = None
+    for _ in range(repeat):
+        args = make_args()
+        start = time.perf_counter()
+        result, ok = _run_once(func, args, "Benchmark")
+        durations.append(time.perf_counter() - start)
+        if ok and check is not None and not check(result, args):
+            logging.error(f"Benchmark run of {func.__name__} did not pass its check")
+            ok = False
+        succeeded = succeeded and ok
+    args = make_args()
+    tracemalloc.start()
+    try:
+        _, ok = _run_once(func, args, "Memory")
+    finally:
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    succeeded = succeeded and ok
+    return result, statistics.median(durations), min(durations), peak / 1024**2, succeeded
+
+def create_sqlite_engine(schema_name):
+    """
+    Creates an in-memory SQLite engine as a local stand-in for the MySQL database
+    The schema is attached as a separate database on every connection
+    """
+    engine = create_engine("sqlite://")
+
+    @event.listens_for(engine, "connect")
+    def attach_schema(dbapi_connection, connection_record):
+        dbapi_connection.execute(f"ATTACH DATABASE ':memory:' AS {schema_name}")
+
+    return engine
+
+def table_row_count(schema_name, table_name, engine):
+    """
+    Returns the number of rows in a table, or 0 if the table does not exist
+    """
+    try:
+        return int(sql.sql_to_df(f"select count(*) as n_rows from {schema_name}.{table_name}", engine)['n_rows'][0])
+    except Exception as ex:
+        logging.error(f"Could not count the rows of {schema_name}.{table_name}: {ex}")
+        return 0
+
+def upload_parquets_to_s3(parquets_folder, bucket_name=BENCHMARK_BUCKET, s3_bucket_path="project_data/parquets/"):
+    """
+    Uploads the converted parquet folders to the moto backed S3 bucket
+    Follows the same path as upload_multiple_files_to_s3_bucket_as_parquet without the conversion
+    moto and the bucket are started by the caller, so only the uploads are timed
+    """
+    subdirs = [x[0] for x in os.walk(parquets_folder) if x[0] != parquets_folder]
+    for subdir in subdirs:
+        subfolder_name = subdir[subdir.find('/')+1:]
+        aws.upload_multiple_files_to_s3_bucket(subdir, bucket_name, f"{s3_bucket_path}/{subfolder_name}/", MOCK_AWS_CONNECTION, 'parquet')
+
+def recreate_benchmark_bucket(bucket_name=BENCHMARK_BUCKET):
+    """
+    Deletes and creates the moto backed bucket, so every upload run starts with an empty bucket
+    Without this the keys of an earlier run would hide a failed upload
+    """
+    aws.delete_s3_bucket(bucket_name, MOCK_AWS_CONNECTION)
+    aws.create_s3_bucket(bucket_name, MOCK_AWS_CONNECTION)
+
+def uploaded_all_parquets(parquets_folder, bucket_name=BENCHMARK_BUCKET, s3_bucket_path="project_data/parquets/"):
+    """
+    Checks that every local parquet file is in the bucket
+    upload_file_to_s3_bucket only logs its errors, so the bucket is compared with the local files
+    """
+    uploaded_keys = aws.list_s3_bucket_keys(bucket_name, s3_bucket_path, MOCK_AWS_CONNECTION)
+    return set(helper.get_parquet_upload_keys(s3_bucket_path, parquets_folder)) <= set(uploaded_keys)
+
+def folder_size_mb(folder_path):
+    """
+    Returns the total size of the files in a folder in MB
+    """
+    return sum(os.path.getsize(os.path.join(root, f)) for root, _, files in os.walk(folder_path) for f in files) / 1024**2
+
+@contextmanager
+def working_directory(folder_path):
+    """
+    Runs the block inside the with statement in folder_path
+    and changes back to the previous folder afterwards
+    """
+    previous_folder = os.getcwd()
+    os.makedirs(folder_path, exist_ok=True)
+    os.chdir(folder_path)
+    try:
+        yield
+    finally:
+        os.chdir(previous_folder)
+
+def run_benchmarks(row_counts, work_dir="benchmark_data", n_extra_columns=0, null_rate=0.0, seed=42, repeat=5, warmup=1):
+    """
+    Generates a dataset for every row count and times each pipeline function on it
+    The pandas and SQL functions run on at most IN_MEMORY_MAX_ROWS rows, measured_rows in the results says how many
+    Everything runs inside work_dir, so the pipeline's own parquets/ folder is never touched
+    Returns a list of results, one per function and row count
+    """
+    with working_directory(work_dir):
+        return _run_benchmarks(row_counts, n_extra_columns, null_rate, seed, repeat, warmup)
+
+def _run_benchmarks(row_counts, n_extra_columns, null_rate, seed, repeat, warmup):
+    """
+    Runs the benchmarks in the current folder
+    """
+    results = []
+    for n_rows in row_counts:
+        data_folder = f"rows_{n_rows}"
+        shutil.rmtree(data_folder, ignore_errors=True)
+        file_path = generate_capacity_csv(os.path.join(data_folder, "renewable_capacity.csv"), n_rows, n_extra_columns, null_rate, seed)
+        # The generator is deterministic by row number, so the sample is the same as the first rows of the dataset
+        # It is written to its own folder, the parquet conversion converts every file in data_folder
+        sample_rows = min(n_rows, IN_MEMORY_MAX_ROWS)
+        sample_path = file_path
+        if sample_rows < n_rows:
+            sample_folder = f"{data_folder}_sample"
+            shutil.rmtree(sample_folder, ignore_errors=True)
+            sample_path = generate_capacity_csv(os.path.join(sample_folder, "renewable_capacity.csv"), sample_rows, n_extra_columns, null_rate, seed)
+        df = pd.read_csv(sample_path)
+
+        # convert_file_to_parquet writes to parquets/ under the current folder, which is work_dir
+        shutil.rmtree("parquets", ignore_errors=True)
+        timings = [("convert_multiple_files_to_parquet", n_rows, measure(helper.convert_multiple_files_to_parquet, lambda: (data_folder,), repeat, warmup))]
+        # preprocess_file changes the frame in place, so every run gets a fresh copy
+        timings.append(("preprocess_file", sample_rows, measure(helper.preprocess_file, lambda: (df.copy(),), repeat, warmup)))
+        preprocessed = df.copy()
+        helper.preprocess_file(preprocessed)
+        timings.append(("get_table_structure", sample_rows, measure(helper.get_table_structure, lambda: (preprocessed, 'sql'), repeat, warmup)))
+        timings.append(("build_insert_query", sample_rows, measure(helper.build_insert_query, lambda: (df,), repeat, warmup)))
+        # Every run inserts into a new database, otherwise the table already exists after the first run
+        # create_table_and_insert_data only prints its errors, so the table is checked for all the rows
+        schema_name = "benchmark_schema"
+        table_name = helper.get_file_name(sample_path)
+        inserted_all_rows = lambda result, args: table_row_count(schema_name, table_name, args[2]) == sample_rows
+        timings.append(("create_table_and_insert_data", sample_rows, measure(sql.create_table_and_insert_data, lambda: (sample_path, schema_name, create_sqlite_engine(schema_name)), repeat, warmup, inserted_all_rows)))
+        with mock_aws():
+            # The bucket is emptied outside the timed block before every run
+            def upload_args():
+                recreate_benchmark_bucket()
+                return ("parquets/",)
+            uploaded_all = lambda result, args: uploaded_all_parquets(args[0])
+            timings.append(("s3_upload", n_rows, measure(upload_parquets_to_s3, upload_args, repeat, warmup, uploaded_all)))
+
+        upload_mb = folder_size_mb("parquets/")
+        for function_name, measured_rows, (_, seconds, min_seconds, peak_memory_mb, succeeded) in timings:
+            result = {
+                "function": function_name,
+                "status": "ok" if succeeded else "failed",
+                "rows": n_rows,
+                "measured_rows": measured_rows,
+                "columns": len(df.columns),
+                "null_rate": null_rate,
+                "repeat": repeat,
+                "seconds": round(seconds, 4),
+                "min_seconds": round(min_seconds, 4),
+                "rows_per_second": round(measured_rows / seconds, 2) if seconds > 0 else None,
+                "peak_memory_mb": round(peak_memory_mb, 3)
+            }
+            if function_name == "s3_upload":
+                result["mb_per_second"] = round(upload_mb / seconds, 3) if seconds > 0 else None
+            logging.info(f"Benchmark {function_name} on {n_rows} rows: {result['seconds']}s, {result['peak_memory_mb']} MB peak")
+            results.append(result)
+    return results
+
+def save_benchmark_results(results, output_path, parameters=None):
+    """
+    Writes the benchmark results to a JSON file together with the run environment
+    """
+    report = {
+        "created_at": datetime.now().isoformat(),
+        "python_version": platform.python_version(),
+        "platform": platform.platform(),
+        "pandas_version": pd.__version__,
+        "parameters": parameters or {},
+        "results": results
+    }
+    try:
+        with open(output_path, "w") as outfile:
+            outfile.write(json.dumps(report, indent=4))
+        logging.info(f"Benchmark results written to {output_path}")
+    except IOError as io:
+        logging.error(io)
+        sys.exit(1)
+    return report
+
+def compare_benchmark_results(baseline_path, current_path, threshold=0.10, min_delta_seconds=0.005):
+    """
+    Compares the median timings of two benchmark JSON files
+    Returns every function and row count that got slower than the baseline by more than threshold
+    Differences below min_delta_seconds are ignored, they are within the noise of very fast functions
+    Runs that failed in the current file are returned with status failed
+    """
+    baseline = json.load(open(baseline_path))
+    current = json.load(open(current_path))
+    # Failed runs have no meaningful timing
+    baseline_seconds = {(r["function"], r["rows"]): r["seconds"] for r in baseline["results"] if r.get("status", "ok") == "ok"}
+    regressions = []
+    for result in current["results"]:
+        key = (result["function"], result["rows"])
+        if result.get("status", "ok") != "ok":
+            regressions.append({"function": result["function"], "rows": result["rows"], "status": "failed"})
+            continue
+        if key not in baseline_seconds or baseline_seconds[key] == 0:
+            continue
+        change = result["seconds"] / baseline_seconds[key] - 1
+        if change > threshold and result["seconds"] - baseline_seconds[key] > min_delta_seconds:
+            regressions.append({
+                "function": result["function"],
+                "rows": result["rows"],
+                "baseline_seconds": baseline_seconds[key],
+                "current_seconds": result["seconds"],
+                "change": round(change, 4)
+            })
+    return regressions
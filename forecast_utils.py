@@ -0,0 +1,147 @@
+import os
+import sys
+sys.path.append(os.path.dirname(__file__))
+import json
+import hashlib
+import warnings
+warnings.simplefilter('ignore')
+import pandas as pd
+import logging
+import shutil
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from prophet import Prophet
+from prophet.serialize import model_to_json, model_from_json
+from libraries import metrics_utils as metrics
+
+# Yearly capacity data has no seasonality inside a year
+DEFAULT_PROPHET_PARAMS = {
+    "yearly_seasonality": False,
+    "weekly_seasonality": False,
+    "daily_seasonality": False
+}
+CACHE_FOLDER = "forecast_cache"
+
+# Hive data types of the pandas columns written to the forecast parquet files
+HIVE_TYPES = {
+    "object": "string",
+    "int64": "bigint",
+    "int32": "int",
+    "float64": "double",
+    "datetime64[ns]": "timestamp",
+    "bool": "boolean"
+}
+
+
+def build_series_query(schema, table_name, series_columns, date_column, value_column):
+    """
+    Builds the Presto query that pulls every series of a table in one go
+    """
+    columns = ', '.join(series_columns + [date_column, value_column])
+    order_by = ', '.join(series_columns + [date_column])
+    return f"select {columns} from {schema}.{table_name} where {value_column} is not null order by {order_by}"
+
+def split_series(df, series_columns, date_column, value_column):
+    """
+    :param df:
+    :return series:
+    Splits the query result into one Prophet ready frame (ds, y) per series
+    Yearly integer dates are turned into the first day of the year
+    The values of duplicate dates within a series are summed
+    """
+    df = df.copy()
+    if pd.api.types.is_integer_dtype(df[date_column]):
+        df[date_column] = pd.to_datetime(df[date_column].astype(str), format='%Y')
+    else:
+        df[date_column] = pd.to_datetime(df[date_column])
+    df = df.groupby(series_columns + [date_column], as_index=False)[value_column].sum()
+    series = {}
+    for key, group in df.groupby(series_columns):
+        key = key if isinstance(key, tuple) else (key,)
+        series[key] = group[[date_column, value_column]].rename(columns={date_column: 'ds', value_column: 'y'}).reset_index(drop=True)
+    return series
+
+def series_hash(series_key, series_df, prophet_params):
+    """
+    Hashes the series key, its data and the model parameters
+    A cached model is only reused if none of them changed
+    """
+    data_hash = pd.util.hash_pandas_object(series_df[['ds', 'y']], index=False).values.tobytes()
+    params = json.dumps({"key": [str(k) for k in series_key], "params": prophet_params}, sort_keys=True).encode()
+    return hashlib.sha256(params + data_hash).hexdigest()
+
+def fit_series(series_key, series_df, periods, freq, prophet_params, cache_folder):
+    """
+    Fits a Prophet model on one series, or loads it from the cache, and forecasts periods ahead
+    Runs in a worker process, so it only takes and returns picklable objects
+    """
+    model_path = os.path.join(cache_folder, f"{series_hash(series_key, series_df, prophet_params)}.json")
+    from_cache = os.path.isfile(model_path)
+    if from_cache:
+        with open(model_path) as infile:
+            model = model_from_json(infile.read())
+    else:
+        model = Prophet(**prophet_params)
+        model.fit(series_df)
+        # Written to a temporary file first, so a killed worker cannot leave half a model behind
+        with open(f"{model_path}.tmp", "w") as outfile:
+            outfile.write(model_to_json(model))
+        os.replace(f"{model_path}.tmp", model_path)
+    future = model.make_future_dataframe(periods=periods, freq=freq, include_history=False)
+    forecast = model.predict(future)[['ds', 'yhat', 'yhat_lower', 'yhat_upper']]
+    return series_key, forecast, from_cache
+
+def forecast_series(series, periods=5, freq='YS', prophet_params=None, cache_folder=CACHE_FOLDER, max_workers=None):
+    """
+    Forecasts every series in parallel with a process pool
+    Series whose data did not change since the last run reuse their cached model
+    Returns one frame with the series keys and the forecasts
+    """
+    prophet_params = prophet_params or DEFAULT_PROPHET_PARAMS
+    os.makedirs(cache_folder, exist_ok=True)
+    forecasts = []
+    with metrics.timer('forecast_seconds'):
+        # Workers are spawned, not forked, so they do not inherit a running Spark JVM or its threads
+        with ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context("spawn")) as executor:
+            futures = {}
+            for key, series_df in series.items():
+                # Prophet needs at least two points to fit a trend
+                if len(series_df) < 2:
+                    logging.info(f"Skipping series {key}: not enough data points")
+                    metrics.increment('forecast_skipped_series')
+                    continue
+                futures[executor.submit(fit_series, key, series_df, periods, freq, prophet_params, cache_folder)] = key
+            for future in as_completed(futures):
+                try:
+                    key, forecast, from_cache = future.result()
+                except Exception as ex:
+                    logging.error(f"Forecast for series {futures[future]} failed: {ex}")
+                    metrics.increment('forecast_failed_series')
+                    continue
+                metrics.increment('forecast_cached_models' if from_cache else 'forecast_fitted_models')
+                forecast.insert(0, 'series_key', [key] * len(forecast))
+                forecasts.append(forecast)
+    logging.info(f"Forecasted {len(forecasts)} of {len(series)} series.")
+    if not forecasts:
+        return pd.DataFrame(columns=['series_key', 'ds', 'yhat', 'yhat_lower', 'yhat_upper'])
+    return pd.concat(forecasts, ignore_index=True)
+
+def write_forecasts_to_parquet(forecasts, series_columns, table_name, parquets_folder="parquets/"):
+    """
+    Writes the forecasts as parquet to the folder the pipeline uploads and registers in Hive
+    Returns the table name and columns in the same format as convert_file_to_parquet
+    """
+    df = pd.DataFrame(forecasts['series_key'].tolist(), columns=series_columns)
+    df = pd.concat([df, forecasts.drop(columns='series_key').reset_index(drop=True)], axis=1)
+    table_folder = os.path.join(parquets_folder, table_name)
+    shutil.rmtree(table_folder, ignore_errors=True)
+    os.makedirs(table_folder, exist_ok=True)
+    # Hive reads parquet timestamps written as INT96
+    df.to_parquet(os.path.join(table_folder, "part-00000.parquet"), engine='pyarrow', index=False,
+                  use_deprecated_int96_timestamps=True)
+    columns = ', '.join(f"{col} {HIVE_TYPES.get(str(dtype), 'string')}" for col, dtype in df.dtypes.items())
+    logging.info(f"Forecasts written to {table_folder}")
+    return {
+        "table_name": table_name,
+        "columns": columns
+    }
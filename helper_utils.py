@@ -3,26 +3,52 @@ import os
 import sys
 sys.path.append(os.path.dirname(__file__))
 import json
+import hashlib
 import warnings
 warnings.simplefilter('ignore')
 import pandas as pd
 import logging
 import re
-from pyspark.sql import SparkSession
+import time
+from pyspark.sql import SparkSession, Observation
+from pyspark.sql import functions as F
+from libraries import metrics_utils as metrics
+
+# Execution backend for the Hive DDL path: 'emr' (default) or 'local'
+# The local backend runs the same DDL on a local Spark session with an embedded metastore
+EXECUTION_BACKEND = os.environ.get("EXECUTION_BACKEND", "emr").lower()
 
-# Initialize Spark session
 # Spark is used to load CSV and convert them to Parquets
-spark = SparkSession.builder.appName("ConvertFiles").getOrCreate()
-spark.conf.set("spark.sql.debug.maxToStringFields", 1000)
-# Specify the logging format
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s [%(levelname)s] %(message)s",
-    handlers=[
-        logging.FileHandler("debug.log"),  # This works only for .py files
-        logging.StreamHandler()
-    ]
-)
+# The session is started on first use, so importing this module does not start a JVM
+spark = None
+hive_support = False
+WAREHOUSE_FOLDER = "spark-warehouse"
+
+def get_spark_session():
+    """
+    Returns the Spark session, starting it on first use
+    The session gets Hive support with an embedded metastore once enable_hive_support was called
+    """
+    global spark
+    if spark is None:
+        spark_builder = SparkSession.builder.appName("ConvertFiles")
+        if hive_support:
+            spark_builder = spark_builder.config("spark.sql.warehouse.dir", os.path.abspath(WAREHOUSE_FOLDER)).enableHiveSupport()
+        spark = spark_builder.getOrCreate()
+        spark.conf.set("spark.sql.debug.maxToStringFields", 1000)
+    return spark
+
+def enable_hive_support():
+    """
+    Makes the Spark session use Hive support, which the local backend needs for the Hive DDL
+    Hive support is a static setting, so a session started without it is stopped and started again
+    """
+    global spark, hive_support
+    hive_support = True
+    if spark is not None and spark.conf.get("spark.sql.catalogImplementation", "in-memory") != "hive":
+        logging.info("Restarting the Spark session with Hive support")
+        spark.stop()
+        spark = None
 
 def replace_in_string(value):
     """
@@ -35,6 +61,7 @@ def replace_in_string(value):
     value = value.replace("__", '_')
     return value
 
+@metrics.profiled
 def build_insert_query(dt):
     """
     :param dt:
@@ -80,6 +107,7 @@ def get_file_type(file_path):
     else:
         return ''
 
+@metrics.profiled
 def preprocess_file(init_df):
     """
     Formats column names to replace non-alphanumeric characters with underscores
@@ -94,6 +122,7 @@ def preprocess_file(init_df):
             except:
                 pass
 
+@metrics.profiled
 def get_table_structure(init_df, dialect='nosql'):
     """
     Builds a table create statement with column names and data types
@@ -131,6 +160,13 @@ def sql_create_table_statement(df, schema_name, table_name):
     n = 10000
     sample_df = df.sample(withReplacement=True, fraction=n/df.count()).toPandas()
     tbl_structure = get_table_structure(sample_df, 'nosql')
+    return build_create_table_statement(tbl_structure, schema_name, table_name)
+
+def build_create_table_statement(tbl_structure, schema_name, table_name):
+    """
+    Build table create statement from a table structure
+    The structure is either the output of get_table_structure or a (columns, data types) pair
+    """
     if isinstance(tbl_structure, pd.DataFrame):
         cols_ = tbl_structure[tbl_structure.columns[0]]
         dtypes_ = tbl_structure[tbl_structure.columns[1]]
@@ -146,6 +182,45 @@ def sql_create_table_statement(df, schema_name, table_name):
     print(f"\n{qry}\n")
     return qry
 
+def build_table_create_statements(files_column_types, schema, hdfs_files_path):
+    """
+    Builds the hive table create statements for the converted parquet files
+    Every statement points to the table folder under hdfs_files_path
+    """
+    create_statements = ""
+    for file_ in files_column_types:
+        create_table_sql = f"create table {schema}.{file_.get('table_name')} ({file_.get('columns')}) " + \
+                           "row format delimited fields terminated by '\\t' " + \
+                           "lines terminated by '\\n' stored as parquet" + \
+                           f" location '{hdfs_files_path}{file_.get('table_name')}'; "
+        create_statements += create_table_sql
+    return create_statements
+
+def get_parquet_upload_keys(s3_bucket_path, files_folder="parquets/"):
+    """
+    Lists the S3 keys the converted parquet files are uploaded to
+    Uses the same folder layout and file filter as upload_multiple_files_to_s3_bucket_as_parquet
+    """
+    keys = []
+    subdirs = [x[0] for x in os.walk(files_folder) if x[0] != files_folder]
+    for subdir in subdirs:
+        subfolder_name = subdir[subdir.find('/')+1:]
+        for file_name in os.listdir(subdir):
+            file_path = os.path.join(subdir, file_name)
+            if os.path.isfile(file_path) and (get_file_type(file_path) == 'parquet' or file_name == '_SUCCESS'):
+                keys.append(f"{s3_bucket_path}/{subfolder_name}//{file_name}".replace("//", '/'))
+    return keys
+
+def read_emr_cluster():
+    """
+    Reads the EMR cluster saved by the last Main_File.py run
+    """
+    auth = json.load(open("auth/auth.json"))
+    if "emr_cluster" not in auth:
+        logging.error("No EMR cluster saved in auth/auth.json. Run the Main_File.py first.")
+        sys.exit(1)
+    return auth["emr_cluster"]
+
 def read_jsons():
     """
     Read the JSON files for the parameters
@@ -164,17 +239,95 @@ def read_jsons():
         "rds_parameters": rds_parameters
     }
 
+def get_input_fingerprint(local_folder_path):
+    """
+    Hashes the names, sizes and modification times of the files in a folder
+    A checkpoint is only reused while its input files did not change
+    """
+    files = []
+    for file_name in sorted(os.listdir(local_folder_path)):
+        file_stat = os.stat(os.path.join(local_folder_path, file_name))
+        files.append([file_name, file_stat.st_size, file_stat.st_mtime])
+    return hashlib.sha256(json.dumps(files).encode()).hexdigest()
+
+def load_run_state(state_file="run_state.json", input_fingerprint=None):
+    """
+    Loads the checkpoint of a previous pipeline run
+    Returns an empty run state if there is no checkpoint yet
+    or if the checkpoint was made for different input files
+    """
+    empty_state = {"completed_stages": [], "outputs": {}, "input_fingerprint": input_fingerprint}
+    if not os.path.isfile(state_file):
+        return empty_state
+    with open(state_file) as infile:
+        run_state = json.load(infile)
+    if run_state.get("input_fingerprint") != input_fingerprint:
+        logging.info(f"The input files changed since the checkpoint in {state_file} was saved. Starting a new run.")
+        return empty_state
+    logging.info(f"Resuming run. Completed stages: {run_state['completed_stages']}")
+    return run_state
+
+def save_run_state(run_state, state_file="run_state.json"):
+    """
+    Persists the run state to the checkpoint file
+    The file is replaced in one step so a crash cannot leave half a checkpoint behind
+    """
+    tmp_file = f"{state_file}.tmp"
+    try:
+        with open(tmp_file, "w") as outfile:
+            outfile.write(json.dumps(run_state, indent=4))
+        os.replace(tmp_file, state_file)
+    except IOError as io:
+        logging.error(io)
+        sys.exit(1)
+
+def is_stage_complete(run_state, stage):
+    """
+    Checks if a stage was completed in a previous run
+    """
+    return stage in run_state["completed_stages"]
+
+def mark_stage_complete(run_state, stage, outputs=None, state_file="run_state.json"):
+    """
+    Records a completed stage and its outputs, then saves the checkpoint
+    A rerun reuses the outputs instead of repeating the stage
+    """
+    run_state["outputs"].update(outputs or {})
+    if stage not in run_state["completed_stages"]:
+        run_state["completed_stages"].append(stage)
+    save_run_state(run_state, state_file)
+    logging.info(f"Stage {stage} completed and checkpointed.")
+
+def clear_run_state(state_file="run_state.json"):
+    """
+    Removes the checkpoint so the next run starts from the beginning
+    """
+    if os.path.isfile(state_file):
+        os.remove(state_file)
+        logging.info(f"Run state {state_file} cleared.")
+
+@metrics.profiled
 def convert_file_to_parquet(file_path):
     """
     Converts a file at the given file_path to a Parquet file
     """
     file_type = get_file_type(file_path)
     if os.path.isfile(file_path) and file_type == 'csv':
-        df = spark.read.options(header=True, inferschema=True).load(file_path, format='csv')
+        file_name = get_file_name(file_path)
+        start = time.perf_counter()
+        df = get_spark_session().read.options(header=True, inferschema=True).load(file_path, format='csv')
         cols_dtypes = [replace_in_string(col[0])+" "+col[1] for col in df.dtypes]
         cols_dtypes = ', '.join(cols_dtypes)
-        file_name = get_file_name(file_path)
+        # The rows are counted while they are written, so no extra Spark job is needed
+        row_count = Observation(f"convert_{file_name}")
+        df = df.observe(row_count, F.count(F.lit(1)).alias("rows"))
         df.write.mode('overwrite').parquet(f"parquets/{file_name}")
+        seconds = time.perf_counter() - start
+        rows = row_count.get["rows"]
+        metrics.observe('parquet_conversion_seconds', seconds, table=file_name)
+        metrics.increment('parquet_converted_rows', rows, table=file_name)
+        metrics.increment('csv_read_bytes', os.path.getsize(file_path), table=file_name)
+        metrics.record_rate('parquet_conversion_rows_per_second', rows, seconds, table=file_name)
         return {
             "table_name": file_name,
             "columns": cols_dtypes
@@ -196,11 +349,13 @@ def convert_multiple_files_to_parquet(local_folder_path):
             file_columns.append(result)
     return file_columns
 
-def write_presto_connector_to_json_file(cluster_url, schema):
+def write_presto_connector_to_json_file(cluster_url, schema, cluster_id=None):
     """
     Writes a cluster URL and the schema name to a JSON
     The analysis file reads these connections and builds
     the Presto connection automatically.
+    The cluster id is kept next to it, so later steps like the forecasts
+    can run hive queries on the same cluster.
     """
     presto_connector = {
         "host": cluster_url,
@@ -211,6 +366,8 @@ def write_presto_connector_to_json_file(cluster_url, schema):
     }
     auth = json.load(open("auth/auth.json"))
     auth[f"presto_connector"] = presto_connector
+    if cluster_id is not None:
+        auth["emr_cluster"] = {"cluster_id": cluster_id, "cluster_url": cluster_url}
     json_object = json.dumps(auth, indent=4)
     try:
         with open("auth/auth.json", "w") as outfile:
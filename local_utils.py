@@ -0,0 +1,162 @@
+import os
+import sys
+sys.path.append(os.path.dirname(__file__))
+from libraries import helper_utils as helper
+from libraries import metrics_utils as metrics
+import warnings
+warnings.simplefilter('ignore')
+import logging
+import re
+import shutil
+
+
+# Local stand-ins for the S3 buckets and the cluster's HDFS root
+# Every function here has the same signature as its aws_utils counterpart,
+# so Main_File.py can run the same calls on either backend
+LOCAL_S3_ROOT = "local_s3"
+LOCAL_HDFS_ROOT = "local_hdfs"
+LOCAL_CLUSTER_ID = "local"
+
+
+def create_s3_bucket(bucket_name, aws_connection):
+    """
+    Creates a local folder standing in for an S3 bucket
+    """
+    os.makedirs(os.path.join(LOCAL_S3_ROOT, bucket_name), exist_ok=True)
+    logging.info(f"Local bucket created: {bucket_name}\n")
+
+
+def upload_multiple_files_to_s3_bucket(local_folder_path, bucket_name, s3_folder_path, aws_connection, desired_file_type = 'csv'):
+    """
+    Copies multiple files to the local bucket folder
+    """
+    files = os.listdir(local_folder_path)
+    for file_name in files:
+        file_path = os.path.join(local_folder_path, file_name)
+        file_type = helper.get_file_type(file_path)
+        s3_file_location = f"{s3_folder_path}/{file_name}".replace("//", '/')
+        if os.path.isfile(file_path) and (file_type==desired_file_type or file_name=='_SUCCESS') :
+            bucket_file_path = os.path.join(LOCAL_S3_ROOT, bucket_name, s3_file_location)
+            os.makedirs(os.path.dirname(bucket_file_path), exist_ok=True)
+            shutil.copyfile(file_path, bucket_file_path)
+
+
+def upload_multiple_files_to_s3_bucket_as_parquet(files_folder, bucket_name, s3_bucket_path, aws_connection):
+    """
+    Converts the csv files to parquet and copies them to the local bucket folder
+    """
+    # Runs next to create_emr_cluster, so Hive support is set before either thread starts Spark
+    helper.enable_hive_support()
+    files_columns = helper.convert_multiple_files_to_parquet(files_folder)
+    files_folder = "parquets/"
+    subdirs = [x[0] for x in os.walk(files_folder) if x[0] != files_folder]
+    for subdir in subdirs:
+        subfolder_name = subdir[subdir.find('/')+1:]
+        upload_multiple_files_to_s3_bucket(subdir, bucket_name, f"{s3_bucket_path}/{subfolder_name}/", aws_connection, 'parquet')
+    return files_columns
+
+
+def list_s3_bucket_keys(bucket_name, s3_folder_path, aws_connection):
+    """
+    Lists the keys of all the files under the specified folder of the local bucket
+    """
+    bucket_folder = os.path.join(LOCAL_S3_ROOT, bucket_name)
+    keys = []
+    for root, _, files in os.walk(bucket_folder):
+        keys.extend([os.path.relpath(os.path.join(root, f), bucket_folder).replace(os.sep, '/') for f in files])
+    return [key for key in keys if key.startswith(s3_folder_path)]
+
+
+def delete_s3_bucket(bucket_name, aws_connection):
+    """
+    Deletes the local bucket folder
+    """
+    shutil.rmtree(os.path.join(LOCAL_S3_ROOT, bucket_name), ignore_errors=True)
+    logging.info(f"The local bucket {bucket_name} has been deleted.")
+
+
+def create_emr_cluster(emr_params, aws_connection, applications):
+    """
+    Starts the local Spark session with Hive support in place of an EMR cluster
+    Returns a cluster id and url like aws_utils.create_emr_cluster
+    """
+    with metrics.timer('emr_cluster_provisioning_seconds'):
+        helper.enable_hive_support()
+        helper.get_spark_session()
+    logging.info("Local Spark session is ready.")
+    return LOCAL_CLUSTER_ID, 'localhost'
+
+
+def get_emr_cluster_state(cluster_id, aws_connection):
+    """
+    The local session is started again on demand, so it is always available
+    """
+    return 'WAITING'
+
+
+def to_spark_sql(query):
+    """
+    :param query:
+    :return statements:
+    Splits a hive script into single statements for spark.sql
+    Spark only accepts ROW FORMAT DELIMITED on textfile tables, so the clause
+    is dropped from parquet tables. Parquet ignores the delimiters anyway.
+    """
+    statements = [stmt.strip() for stmt in query.split(';') if stmt.strip()]
+    row_format = re.compile(r"\s+row format delimited.*?(?=\s+stored as parquet)", re.IGNORECASE)
+    return [row_format.sub('', stmt) for stmt in statements]
+
+
+def execute_hive_query(cluster_id, aws_connection, query):
+    """
+    Executes a hive query on the local Spark session
+    Hive support is switched on here, so the DDL also works when this is the first Spark use
+    """
+    logging.info(f"\n\tExecuting Hive Query: {query} on local Spark")
+    try:
+        helper.enable_hive_support()
+        spark = helper.get_spark_session()
+        with metrics.timer('local_query_seconds'):
+            for statement in to_spark_sql(query):
+                spark.sql(statement)
+        print('Command executed on local Spark session')
+    except Exception as ex:
+        logging.exception(ex)
+        sys.exit(1)
+
+
+def copy_parquets_to_hdfs(cluster_id, s3_bucket_name, s3_bucket_path, aws_connection, hdfs_folder_path=None):
+    """
+    Copy files from the local bucket folder to the local HDFS stand-in
+    The folder layout matches what s3-dist-cp produces on EMR
+    """
+    logging.info("\n")
+    if hdfs_folder_path is None:
+        hdfs_folder_path = os.path.abspath(f"{LOCAL_HDFS_ROOT}/user/hadoop/{s3_bucket_path}") + '/'
+    s3_location = os.path.join(LOCAL_S3_ROOT, s3_bucket_name, s3_bucket_path.replace('//', '/'))
+    logging.info(f"Copying parquet files from local bucket folder {s3_location} to local HDFS folder: {hdfs_folder_path}")
+    try:
+        # Spark names the part files with a new uuid on every write, so the table folders
+        # of an earlier run are removed first. Otherwise old and new rows would be read together
+        for table_folder in os.listdir(s3_location):
+            shutil.rmtree(os.path.join(hdfs_folder_path, table_folder), ignore_errors=True)
+        shutil.copytree(s3_location, hdfs_folder_path, dirs_exist_ok=True)
+    except Exception as ex:
+        logging.exception(ex)
+        sys.exit(1)
+    return f"file://{hdfs_folder_path}"
+
+
+def execute_table_create_statements(cluster_id, aws_connection, files_column_types, schema, hdfs_files_path):
+    """
+    Builds and executes the hive table create statements on the local Spark session
+    The statements are the same ones aws_utils runs on EMR
+    """
+    create_statements = helper.build_table_create_statements(files_column_types, schema, hdfs_files_path)
+    try:
+        execute_hive_query(cluster_id, aws_connection, create_statements)
+        logging.info(f"Tables Created successfully.\n{[file_.get('table_name') for file_ in files_column_types]}\n")
+
+    except Exception as e:
+        logging.error(e)
+        sys.exit(1)
@@ -0,0 +1,192 @@
+import os
+import sys
+sys.path.append(os.path.dirname(__file__))
+import atexit
+import cProfile
+import functools
+import io
+import json
+import logging
+import pstats
+import threading
+import time
+from contextlib import contextmanager
+
+# Shared logging setup for all the library modules
+# Configured once here instead of in every module
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s [%(levelname)s] %(message)s",
+    handlers=[
+        logging.FileHandler("debug.log"),  # This works only for .py files
+        logging.StreamHandler()
+    ]
+)
+
+# Set PIPELINE_PROFILE=1 to run the hot functions under cProfile
+PROFILE_ENABLED = os.environ.get("PIPELINE_PROFILE", "0") not in ("", "0")
+PROFILE_FOLDER = "profiles"
+
+# The pipeline runs stages on several threads, so every update takes the lock
+_lock = threading.Lock()
+_profile_lock = threading.Lock()
+_counters = {}
+_timers = {}
+_events = []
+_profilers = {}
+
+
+def _labels_key(labels):
+    """
+    Turns a labels dictionary into a hashable and sorted key
+    """
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+def _record_event(metric, value, labels):
+    """
+    Keeps a single measurement for the JSON-lines export
+    """
+    _events.append({"timestamp": time.time(), "metric": metric, "value": value, "labels": labels})
+
+def increment(metric, value=1, **labels):
+    """
+    Adds value to a counter, e.g. rows converted or bytes uploaded
+    """
+    with _lock:
+        key = (metric, _labels_key(labels))
+        _counters[key] = _counters.get(key, 0) + value
+        _record_event(metric, value, labels)
+
+def observe(metric, seconds, **labels):
+    """
+    Records a duration in seconds for a timer
+    """
+    with _lock:
+        key = (metric, _labels_key(labels))
+        count, total = _timers.get(key, (0, 0.0))
+        _timers[key] = (count + 1, total + seconds)
+        _record_event(metric, seconds, labels)
+
+def record_rate(metric, amount, seconds, **labels):
+    """
+    Records a throughput, e.g. rows/s or MB/s, as a single event
+    Rates are derived values, so they only go to the JSON-lines export
+    """
+    if seconds <= 0:
+        return
+    with _lock:
+        _record_event(metric, amount / seconds, labels)
+
+@contextmanager
+def timer(metric, **labels):
+    """
+    Times the block inside the with statement
+    The duration is recorded even if the block raises or calls sys.exit
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(metric, time.perf_counter() - start, **labels)
+
+def timed(func, metric, **labels):
+    """
+    Wraps func so every call is timed, e.g. the target of a thread
+    """
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        with timer(metric, **labels):
+            return func(*args, **kwargs)
+    return wrapper
+
+def profiled(func):
+    """
+    Decorator that runs func under cProfile when PIPELINE_PROFILE is set
+    All the calls of a function are collected in one profiler
+    and written to profiles/<function name>.prof when the process ends
+    Only the outermost profiled call is captured, cProfile cannot nest
+    """
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if not PROFILE_ENABLED or not _profile_lock.acquire(blocking=False):
+            return func(*args, **kwargs)
+        profiler = _profilers.setdefault(func.__name__, cProfile.Profile())
+        try:
+            profiler.enable()
+            return func(*args, **kwargs)
+        finally:
+            profiler.disable()
+            _profile_lock.release()
+    return wrapper
+
+def write_profiles():
+    """
+    Writes the collected profile of every profiled function to profiles/
+    and logs the ten most expensive calls of each
+    """
+    for func_name, profiler in _profilers.items():
+        os.makedirs(PROFILE_FOLDER, exist_ok=True)
+        profile_path = os.path.join(PROFILE_FOLDER, f"{func_name}.prof")
+        profiler.dump_stats(profile_path)
+        summary = io.StringIO()
+        pstats.Stats(profiler, stream=summary).sort_stats("cumulative").print_stats(10)
+        logging.info(f"Profile of {func_name} written to {profile_path}\n{summary.getvalue()}")
+
+if PROFILE_ENABLED:
+    atexit.register(write_profiles)
+
+def _format_labels(labels_key, extra=()):
+    """
+    Formats labels in the prometheus text format
+    """
+    pairs = list(labels_key) + list(extra)
+    if not pairs:
+        return ""
+    escaped = [(k, v.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')) for k, v in pairs]
+    return "{" + ",".join(f'{k}="{v}"' for k, v in escaped) + "}"
+
+def to_prometheus_text():
+    """
+    Builds the prometheus text format of all counters and timers
+    Counters are exported as <metric>_total and timers as summaries with _count and _sum
+    """
+    lines = []
+    with _lock:
+        counters = dict(_counters)
+        timers = dict(_timers)
+    for metric in sorted({m for m, _ in counters}):
+        lines.append(f"# TYPE {metric}_total counter")
+        for (m, labels_key), value in sorted(counters.items()):
+            if m == metric:
+                lines.append(f"{metric}_total{_format_labels(labels_key)} {value}")
+    for metric in sorted({m for m, _ in timers}):
+        lines.append(f"# TYPE {metric} summary")
+        for (m, labels_key), (count, total) in sorted(timers.items()):
+            if m == metric:
+                lines.append(f"{metric}_count{_format_labels(labels_key)} {count}")
+                lines.append(f"{metric}_sum{_format_labels(labels_key)} {total}")
+    return "\n".join(lines) + "\n"
+
+def export_metrics(jsonl_path="metrics.jsonl", prometheus_path="metrics.prom"):
+    """
+    Writes every recorded measurement to a JSON-lines file
+    and the aggregated counters and timers to a prometheus text file
+    """
+    with _lock:
+        events = list(_events)
+    try:
+        with open(jsonl_path, "w") as outfile:
+            for event in events:
+                outfile.write(json.dumps(event) + "\n")
+        with open(prometheus_path, "w") as outfile:
+            outfile.write(to_prometheus_text())
+        logging.info(f"Metrics written to {jsonl_path} and {prometheus_path}")
+    except IOError as ex:
+        logging.error(ex)
+
+def export_metrics_at_exit(jsonl_path="metrics.jsonl", prometheus_path="metrics.prom"):
+    """
+    Exports the metrics when the process ends
+    This also covers runs that stop with sys.exit after a failed step
+    """
+    atexit.register(export_metrics, jsonl_path, prometheus_path)
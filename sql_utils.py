@@ -2,22 +2,17 @@ import os
 import sys
 sys.path.append(os.path.dirname(__file__))
 from random import randint
+import json
 import warnings
 warnings.simplefilter('ignore')
 import pandas as pd
 from sqlalchemy import create_engine, text
 import helper_utils as helper
+from libraries import metrics_utils as metrics
 import logging
+import time
 from urllib.parse import quote
 
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s [%(levelname)s] %(message)s",
-    handlers=[
-        logging.FileHandler("debug.log"),
-        logging.StreamHandler()
-    ]
-)
 
 def create_db_engine(conn_parameters, conn_engine='mysql', conn_name='local', db_url='127.0.0.1'):
     """
@@ -41,6 +36,22 @@ def create_db_engine(conn_parameters, conn_engine='mysql', conn_name='local', db
     engine = create_engine(connection_url)
     return engine
 
+def create_presto_engine(auth_file="auth/auth.json"):
+    """
+    Create a Presto engine from the connector saved by the Main_File.py run.
+
+    Parameters:
+    - auth_file: str - JSON file holding the presto_connector entry (default is 'auth/auth.json').
+
+    Returns:
+    - engine: SQLAlchemy engine - Presto engine on the hive catalog and project schema.
+    """
+    presto = json.load(open(auth_file))['presto_connector']
+    logging.info("Creating presto connection string")
+    connection_url = f"presto://{presto['username']}@{presto['host']}:{presto['port']}/{presto['catalog']}/{presto['schema']}"
+    engine = create_engine(connection_url)
+    return engine
+
 def execute_query(sql, engine):
     """
     Execute a SQL query using the specified engine.
@@ -165,8 +176,8 @@ def create_table_and_insert_data(file_path, schema_name, engine, table_name=None
         helper.preprocess_file(df)
         if table_name is None:
             table_name = helper.get_file_name(file_path)
-        tbl_struct = helper.get_table_structure(df)
-        create_tbl_str = helper.sql_create_table_statement(tbl_struct, schema_name, table_name)
+        tbl_struct = helper.get_table_structure(df, 'sql')
+        create_tbl_str = helper.build_create_table_statement(tbl_struct, schema_name, table_name)
         create_schema(schema_name, engine)
         logging.info("Finished with schema")
         # if table exists, an error code of 404 with an error is returned, and termination should stop
@@ -177,8 +188,14 @@ def create_table_and_insert_data(file_path, schema_name, engine, table_name=None
             return
         logging.info(f"{create_table_res}")
         try:
+            start = time.perf_counter()
             df.to_sql(name=table_name, schema=schema_name, con=engine, if_exists='replace', index=False)
+            seconds = time.perf_counter() - start
+            metrics.observe('sql_insert_seconds', seconds, table=table_name)
+            metrics.increment('sql_inserted_rows', len(df), table=table_name)
+            metrics.record_rate('sql_insert_rows_per_second', len(df), seconds, table=table_name)
         except Exception as ex:
+            metrics.increment('sql_insert_failures', table=table_name)
             logging.error(ex)
             sys.exit(1)
         logging.info(f"Data inserted into {schema_name}.{table_name} table successfully.")